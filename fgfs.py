@@ -16,13 +16,16 @@
 # along with IGCVis.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import functools
 import itertools
-import json
 import logging
+import os.path
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, time, timedelta, timezone
 
 import numpy as np
+import orjson
 from pyproj import Transformer
 from scipy.interpolate import interp1d
 from scipy.spatial.transform import Rotation
@@ -34,6 +37,9 @@ EPSG_ECEF = 4978
 
 TDELTA = 0.1
 
+# Shared local X/Y to ECEF transformer, built once per process
+ECEF_TRANSFORMER = Transformer.from_crs(igc.EPSG_XY, EPSG_ECEF, always_xy=True)
+
 # Parse IGC UTC value
 def parse_time(utc):
     h, ms = divmod(int(utc), 10000)
@@ -43,33 +49,44 @@ def parse_time(utc):
 
 # Find (local) time in array of UTC timestamps
 def find_time(utc_ts, time, tz=None):
-    return [i for (i, ts) in enumerate(utc_ts)
-            if datetime.fromtimestamp(ts, tz=tz).time() == time][0]
+    # UTC offset at the start of the log
+    if tz is None:
+        offset = datetime.fromtimestamp(utc_ts[0]).astimezone().utcoffset()
+    else:
+        offset = tz.utcoffset(None)
 
-# Convert local heading/roll/pitch to ECEF rotation vector
-def hrp_to_rvec(lat, lon, hrp):
-    # Rotate orientation from local to ECEF
-    view_attitude = Rotation.from_euler("zyx", [0, 0, 0], degrees=True).as_matrix()
+    # Local seconds-of-day at the start of the log
+    sod = (utc_ts[0] + offset.total_seconds()) % 86400
 
-    # Rotate to view
-    rot = Rotation.from_euler("zyx", [-lon, lat, 0], degrees=True)
-    view_attitude = rot.apply(view_attitude)
+    # Target timestamp, allowing for a midnight crossing
+    target = time.hour * 3600 + time.minute * 60 + time.second
+    target_ts = utc_ts[0] + target - sod
+    if target < sod:
+        target_ts += 86400
 
-    # Swap axes
-    rot = Rotation.from_euler("zyx", [0, 90, 0], degrees=True)
-    view_attitude = rot.apply(view_attitude)
+    # Timestamps are uniformly spaced, so index directly (with a small
+    # tolerance for float rounding in the resampled timestamps)
+    tdelta = utc_ts[1] - utc_ts[0]
+    n = round((target_ts - utc_ts[0]) / tdelta)
+    if n < 0 or n >= len(utc_ts) or abs(utc_ts[n] - target_ts) > 1e-5:
+        raise IndexError("time not found")
+
+    return n
+
+# Convert local heading/roll/pitch to ECEF rotation vector
+def hrp_to_rvec(lat, lon, hrp):
+    # Rotation from local to ECEF view, with axis swap
+    view_rot = (Rotation.from_euler("zyx", [0, 90, 0], degrees=True) *
+                Rotation.from_euler("zyx", [-lon, lat, 0], degrees=True))
 
-    orientations = []
-    for h, r, p in hrp.transpose():
-        # Set attitude
-        rot = Rotation.from_euler("zyx", [-h, -p, -r], degrees=True)
-        ecef_attitude = rot.apply(view_attitude)
+    # Set attitudes, batched over all samples
+    eulers = np.stack((-hrp[0], -hrp[2], -hrp[1]), axis=1)
+    rots = Rotation.from_euler("zyx", eulers, degrees=True)
 
-        # Convert to rotation vector
-        orientation = Rotation.from_matrix(ecef_attitude).as_rotvec()
-        orientations.append(orientation)
+    # Compose (quaternion product) and convert to rotation vectors
+    orientations = (rots * view_rot).inv().as_rotvec()
 
-    return np.stack(orientations, axis=1)
+    return orientations.transpose()
 
 # Intepolate position and orientation
 def interpolate(xyz, hrp, interp):
@@ -106,9 +123,10 @@ def format_fgfs(lat, lon, start, stop, t, xyz, hrp, interp, tz=None):
     # Time step size
     tdelta = t[1] - t[0]
 
-    # Convert local X/Y/Z to ECEF
-    transformer = Transformer.from_crs(igc.EPSG_XY, EPSG_ECEF)
-    xec, yec, zec = transformer.transform(xyz1[1], xyz1[0], xyz1[2])
+    # Convert local X/Y/Z to ECEF. Contiguous float64 input avoids
+    # pyproj copying each axis internally
+    xyz_c = np.ascontiguousarray(xyz1, dtype=np.float64)
+    xec, yec, zec = ECEF_TRANSFORMER.transform(xyz_c[0], xyz_c[1], xyz_c[2])
     position = np.stack((xec, yec, zec))
 
     # Calculate ECEF speed components
@@ -117,26 +135,75 @@ def format_fgfs(lat, lon, start, stop, t, xyz, hrp, interp, tz=None):
     # ECEF rotation vector
     orientations = hrp_to_rvec(lat, lon, hrp1)
 
-    # Combine data into 2D array
-    fgfs_data = np.stack(
-        (xec, yec, zec,
-            orientations[0], orientations[1], orientations[2],
-            velocity[0], velocity[1], velocity[2]),
-        axis=1)
+    # Combine data into 2D array, downcasting column by column
+    fgfs_data = np.empty((len(xec), 9), dtype=np.float32)
+    fgfs_data[:, 0] = xec
+    fgfs_data[:, 1] = yec
+    fgfs_data[:, 2] = zec
+    fgfs_data[:, 3:6] = orientations.transpose()
+    fgfs_data[:, 6:9] = velocity.transpose()
 
     return fgfs_data
 
+# Read an IGC file and convert it to FGFS data
+def process_log(igc_path, elevation, geoid, wind_speed, wind_dir,
+                start, stop, replay_rate, tz):
+    # Read IGC file
+    print("Reading %s" % igc_path)
+    with open(igc_path, errors=None) as igc_file:
+        hdr, data = parse_igc(igc_file)
+    id = hdr.get('cucid') or hdr.get('cid') or hdr.get('gid') or hdr['id']
+
+    # Discard first few samples
+    data = data[5:]
+
+    # Materialise contiguous per-field arrays from the structured data
+    utc, lat, lon, alt_pressure, alt_gps = [
+            np.ascontiguousarray(data[f])
+            for f in ('utc', 'lat', 'lon', 'alt', 'alt_gps')]
+
+    # Reference position for the local to ECEF rotation
+    mean_lat = lat.mean()
+    mean_lon = lon.mean()
+
+    # Get sample interval
+    tdelta_igc = igc.get_tdelta(utc)
+    if tdelta_igc > 4:
+        logging.warning("skipping, sample interval > 4 s, %d s" % tdelta_igc)
+        return None
+
+    # Convert to geoid referenced GPS
+    alt_geoid = igc.check_geoid(alt_gps, elevation, geoid)
+
+    # Convert to calibrated pressure altitude
+    alt = igc.calibrate_altitude(alt_pressure, alt_geoid)
+
+    # Convert and interpolate to local X/Y/Z
+    t, xyz = igc.resample_xyz(utc, lat, lon, alt, TDELTA)
+
+    # Calculate flight dynamics
+    xyz1, hrp = igc.dynamics(xyz, TDELTA, wind_speed, wind_dir)
+
+    # Get data for FGFS
+    out = format_fgfs(mean_lat, mean_lon, start, stop, t, xyz, hrp,
+            replay_rate, tz)
+    if out is None:
+        logging.warning("no data found")
+        return None
+
+    return id, out, hdr.get('dte').split(",")[0]
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('elevation', type=float, help='takeoff elevation (m)')
-    parser.add_argument('igc', nargs='+',
-                        type=argparse.FileType('r', errors=None),
-                        help='IGC log file')
+    parser.add_argument('igc', nargs='+', help='IGC log file')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-d', '--diag', action='store_true',
                         help='diagnostic plots')
-    group.add_argument('-f', '--file', type=argparse.FileType('wt'),
+    group.add_argument('-f', '--file', type=argparse.FileType('wb'),
                         help="JSON Output file")
+    parser.add_argument('-b', '--binary',
+                        help='write log data to binary (npy) sidecar file')
     parser.add_argument('-s', '--start', type=int,
                         help='UTC start time (format 130415)')
     parser.add_argument('-t', '--stop', type=int,
@@ -163,57 +230,58 @@ if __name__ == '__main__':
     else:
         tz = timezone(timedelta(hours=args.utcoffset))
 
-    # Start/stop times
     if args.file:
+        # Start/stop times
         start = parse_time(args.start)
         stop = parse_time(args.stop)
 
-    logs = []
-    ids = []
-    for igc_file in args.igc:
-        # Read IGC file
-        print("Reading %s" % igc_file.name)
-        hdr, data = parse_igc(igc_file)
-        id = hdr.get('cucid') or hdr.get('cid') or hdr.get('gid') or hdr['id']
-
-        # Discard first few samples
-        data = data[5:]
-
-        utc, lat, lon = data['utc'], data['lat'], data['lon']
-        alt_pressure, alt_gps = data['alt'], data['alt_gps']
+        # Process logs in parallel, one process per file
+        worker = functools.partial(process_log,
+                elevation=args.elevation, geoid=args.geoid,
+                wind_speed=args.wind_speed, wind_dir=args.wind_dir,
+                start=start, stop=stop, replay_rate=args.replay_rate, tz=tz)
+        with ProcessPoolExecutor() as executor:
+            results = [out for out in executor.map(worker, args.igc)
+                       if out is not None]
+
+        ids = [id for (id, out, log_date) in results]
+        logs = [{'data': out, 'id': id} for (id, out, log_date) in results]
+        log_date = results[-1][2]
+    else:
+        for igc_path in args.igc:
+            # Read IGC file
+            print("Reading %s" % igc_path)
+            with open(igc_path, errors=None) as igc_file:
+                hdr, data = parse_igc(igc_file)
 
-        # Get sample interval
-        tdelta_igc = igc.get_tdelta(utc)
-        if tdelta_igc > 4:
-            logging.warning("skipping, sample interval > 4 s, %d s" % tdelta_igc)
-            continue
+            # Discard first few samples
+            data = data[5:]
 
-        # Convert to geoid referenced GPS
-        alt_geoid = igc.check_geoid(alt_gps, args.elevation, args.geoid)
+            utc, lat, lon, alt_pressure, alt_gps = [
+                    np.ascontiguousarray(data[f])
+                    for f in ('utc', 'lat', 'lon', 'alt', 'alt_gps')]
 
-        # Convert to calibrated pressure altitude
-        alt, cal_errors = igc.calibrate_altitude(alt_pressure, alt_geoid,
-                errors=True)
+            # Get sample interval
+            tdelta_igc = igc.get_tdelta(utc)
+            if tdelta_igc > 4:
+                logging.warning("skipping, sample interval > 4 s, %d s" %
+                        tdelta_igc)
+                continue
 
-        # Convert and interpolate to local X/Y/Z
-        t, xyz = igc.resample_xyz(utc, lat, lon, alt, TDELTA)
+            # Convert to geoid referenced GPS
+            alt_geoid = igc.check_geoid(alt_gps, args.elevation, args.geoid)
 
-        # Calculate flight dynamics
-        xyz1, hrp = igc.dynamics(xyz, TDELTA, args.wind_speed, args.wind_dir)
+            # Convert to calibrated pressure altitude
+            alt, cal_errors = igc.calibrate_altitude(alt_pressure, alt_geoid,
+                    errors=True)
 
-        if args.file:
-            # Get data for FGFS
-            out = format_fgfs(data['lat'].mean(), data['lon'].mean(),
-                    start, stop, t, xyz, hrp, args.replay_rate, tz)
+            # Convert and interpolate to local X/Y/Z
+            t, xyz = igc.resample_xyz(utc, lat, lon, alt, TDELTA)
 
-            if not out is None:
-                ids.append(id)
-                logs.append({'data': out.tolist(), 'id': id})
+            # Calculate flight dynamics
+            xyz1, hrp = igc.dynamics(xyz, TDELTA, args.wind_speed,
+                    args.wind_dir)
 
-                log_date = hdr.get('dte').split(",")[0]
-            else:
-                logging.warning("no data found")
-        else:
             # Diagnostic plots
             from matplotlib import pyplot
 
@@ -238,4 +306,15 @@ if __name__ == '__main__':
                 'tdelta': TDELTA / args.replay_rate,
                 'ids': ids,
                 'logs': logs}
-        json.dump(data, args.file)
+
+        if args.binary:
+            # Log data goes to a binary sidecar, JSON keeps the metadata
+            bin_path = args.binary
+            if not bin_path.endswith(".npy"):
+                bin_path += ".npy"
+            np.save(bin_path, np.stack([log['data'] for log in logs]))
+
+            data['bin'] = os.path.basename(bin_path)
+            data['logs'] = [{'id': id} for id in ids]
+
+        args.file.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
@@ -18,6 +18,7 @@
 import json
 import sys
 from datetime import time
+from time import monotonic
 
 import numpy as np
 import tkinter as tk
@@ -48,6 +49,7 @@ class App(tk.Frame):
         self.drag = False
 
         self.count = 0
+        self.next_tick = monotonic() * 1000
         self.tick()
 
     def create_widgets(self):
@@ -124,7 +126,12 @@ class App(tk.Frame):
         self.label_var.set("%02d:%02d:%04.1f" % (hour, minute, second))
 
         self.replay.replay(self.count, freeze=freeze)
-        self.after(TDELTA, self.tick)
+
+        # Schedule from a monotonic deadline so replay doesn't drift by
+        # the per-tick processing time
+        self.next_tick += TDELTA
+        self.after(max(1, round(self.next_tick - monotonic() * 1000)),
+                self.tick)
 
 if __name__ == '__main__':
     import argparse
@@ -143,7 +150,7 @@ if __name__ == '__main__':
             help='print log info')
     args = parser.parse_args()
 
-    data = json.load(args.file)
+    data = replay.load_data(args.file)
 
     print("Start: %s" % data['start'])
     print("Logs: %s" % ", ".join(data['ids']))
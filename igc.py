@@ -19,34 +19,33 @@ import logging
 
 import numpy as np
 from pyproj import Transformer
-from scipy.interpolate import splrep, splev
+from scipy.interpolate import CubicSpline
+from scipy.ndimage import uniform_filter1d
 
 EPSG_WGS84 = 4326
 EPSG_XY = 3035
 
+# Shared WGS84 to local X/Y transformer, built once per process
+XY_TRANSFORMER = Transformer.from_crs(EPSG_WGS84, EPSG_XY, always_xy=True)
+
 # Apply simple running average
 def boxcar(data, n):
     # Filter length must be odd
     n1 = int(n // 2) * 2 + 1
 
-    kernel = np.ones(n1) / n1
-    m = n1 // 2
-
-    # Pad data to minimise end effects
-    pad = np.ones(m)
-    d = np.concatenate((pad * data[0], data, pad * data[-1]))
+    # Single sample window is a no-op
+    if n1 == 1:
+        return np.asarray(data)
 
-    out = np.convolve(d, kernel, mode='valid')
-    return out
+    # O(N) running mean, edges padded with the end values
+    return uniform_filter1d(data, size=n1, mode='nearest')
 
 # Caculate velocities from array of XYZ
 def speed(xyz, tdelta):
     v = np.diff(xyz, append=xyz[:, -1:]) / tdelta
-    vx = boxcar(v[0], 3.0 / tdelta)
-    vy = boxcar(v[1], 3.0 / tdelta)
-    vz = boxcar(v[2], 3.0 / tdelta)
 
-    return np.stack((vx, vy, vz))
+    # Filter all three axes in one pass (boxcar works on the last axis)
+    return boxcar(v, 3.0 / tdelta)
 
 def get_tdelta(utc):
     # Sample interval
@@ -85,11 +84,16 @@ def calibrate_altitude(alt_pressure, alt_gps, errors=False):
     bins = np.arange(min_alt, max_alt + bin_size, bin_size)
     n_bins = len(bins)
 
-    inds = np.digitize(alt_pressure, bins)
+    # Bins are uniform width, so index arithmetically rather than with
+    # np.digitize's binary search
+    inds = ((alt_pressure - min_alt) // bin_size).astype(np.intp) + 1
 
-    # Calculate average error for each pressure altitude bin
-    error = alt_gps -  alt_pressure
-    avg_errors = [np.mean(error[np.where(inds == b)]) for b in range(1, n_bins)]
+    # Calculate average error for each pressure altitude bin - one
+    # bincount pass instead of a mask per bin
+    error = alt_gps - alt_pressure
+    sums = np.bincount(inds, weights=error, minlength=n_bins)[1:n_bins]
+    counts = np.bincount(inds, minlength=n_bins)[1:n_bins]
+    avg_errors = sums / counts
 
     # Calculate calibration using simple linear interpolation
     cal = np.interp(alt_pressure, bins[:-1] + bin_size / 2, avg_errors)
@@ -105,18 +109,15 @@ def calibrate_altitude(alt_pressure, alt_gps, errors=False):
 # Convert to local X/Y coordinates and resample data
 def resample_xyz(utc, lat, lon, alt, resample_t):
     # Convert to local x/y coordinates
-    transformer = Transformer.from_crs(EPSG_WGS84, EPSG_XY)
-    y, x = transformer.transform(lat, lon)
+    x, y = XY_TRANSFORMER.transform(lon, lat)
 
-    # Resample using cubic splines
+    # Resample using cubic splines, one fit/evaluation for all three axes
     n = round((utc[-1] - utc[0]) / resample_t) + 1
     t = (np.arange(n) * resample_t) + utc[0]
 
-    x1 = splev(t, splrep(utc, x, s=0), der=0)
-    y1 = splev(t, splrep(utc, y, s=0), der=0)
-    z1 = splev(t, splrep(utc, alt, s=0), der=0)
+    spline = CubicSpline(utc, np.stack((x, y, alt), axis=1))
 
-    return t, np.stack((x1, y1, z1))
+    return t, spline(t).transpose()
 
 # Calculate flight dynamics, heading, roll, etc.
 def dynamics(xyz, tdelta, wind_speed, wind_dir):
@@ -127,33 +128,34 @@ def dynamics(xyz, tdelta, wind_speed, wind_dir):
     y = xyz[1]
     z = xyz[2]
 
-    # Correct for wind velocity
-    n = len(x)
-    wind_x = np.arange(n) * wind_speed * tdelta * np.sin(wind_dir)
-    wind_y = np.arange(n) * wind_speed * tdelta * np.cos(wind_dir)
-    xw = x + wind_x
-    yw = y + wind_y
+    # Correct for wind velocity - per-sample drift is a scalar times
+    # the sample index
+    idx = np.arange(len(x))
+    xw = x + (wind_speed * tdelta * np.sin(wind_dir)) * idx
+    yw = y + (wind_speed * tdelta * np.cos(wind_dir)) * idx
 
-    # Calculate (unwrapped) heading
+    # Calculate heading, averaging on the unit circle to avoid an unwrap
     xdelta = np.diff(xw, append=xw[-1:])
     ydelta = np.diff(yw, append=yw[-1:])
-    heading = np.unwrap(np.arctan2(xdelta, ydelta))
+    heading = np.arctan2(xdelta, ydelta)
 
-    av_heading = boxcar(heading, 4 / tdelta)
+    av_heading = np.angle(boxcar(np.exp(1j * heading), 4 / tdelta))
 
-    # Calculate speed
-    speed = np.sqrt(xdelta ** 2  + ydelta ** 2) / tdelta
+    # Calculate speed - hypot in one pass, then scale in place
+    speed = np.hypot(xdelta, ydelta)
+    speed /= tdelta
     speed = boxcar(speed, 5 / tdelta)
 
-    # Bank angle
-    omega = np.diff(heading, append=heading[-1:]) / tdelta
+    # Bank angle, folding heading differences to +/-180 degrees
+    omega = np.diff(heading, append=heading[-1:])
+    omega = ((omega + np.pi) % (2 * np.pi) - np.pi) / tdelta
     bank = np.degrees(np.arctan(omega * speed / 9.81))
     bank = boxcar(bank, 5 / tdelta)
 
-    # Pitch angle
+    # Pitch angle, reusing the diff buffer for the ratio
     zdelta = np.diff(z, append=z[-1:])
-    pitch = np.degrees(zdelta / (speed * tdelta))
-    pitch = boxcar(pitch, 2 / tdelta)
+    zdelta /= speed * tdelta
+    pitch = boxcar(np.degrees(zdelta, out=zdelta), 2 / tdelta)
 
     xyz_out = np.stack((xw, yw, z))
     hrp_out = np.stack((np.mod(np.degrees(av_heading), 360), bank, pitch))
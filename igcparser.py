@@ -19,36 +19,49 @@ import logging
 import re
 import sys
 from datetime import datetime, timedelta, timezone
-from io import StringIO
 
 import numpy as np
 
 A_REC_RE = "A(\w{3})(\w{3})"
 H_DATE_REC_RE = "HFDTE[A-Za-z]?:?(\d{6})"
 I_REC_RE = "I(\d{2})(.*)"
-B_REC_RE = "B(\d{2})(\d{2})(\d{2})(\d{2})(\d{5})([NS])(\d{3})(\d{5})([EW])A(\d{5})(\d{5})"
 
 IGC_TLA = {
     'siu': 'i8',
     'fxa': 'i8'
 }
 
+# Fold fixed-width ASCII digit columns into integers
+def parse_digits(raw, start, stop):
+    out = raw[:, start].astype(np.int64) - ord('0')
+    for i in range(start + 1, stop):
+        out = out * 10 + (raw[:, i] - ord('0'))
+
+    return out
+
 def parse_igc(igc_file):
-    lines = igc_file.readlines()
+    # Split the file once, discarding line terminators up front
+    lines = igc_file.read().splitlines()
+
+    # Sort records by type in a single pass
+    recs = {c: [] for c in "AHIBL"}
+    for line in lines:
+        rec_list = recs.get(line[:1])
+        if rec_list is not None:
+            rec_list.append(line)
 
     # A record
-    arec = [x for x in lines if x[0] == "A"][0]
+    arec = recs["A"][0]
 
     # H records
     header = {'id': arec[1:7]}
 
-    hrec = [x for x in lines if x[0] == "H"]
-    for rec in hrec:
+    for rec in recs["H"]:
         key = rec[2:5].lower()
         if ":" in rec:
             header[key] = rec.split(":")[1].strip()
         else:
-            header[key] = rec[5:-1]
+            header[key] = rec[5:]
 
     # Header dte record is UTC date of first fix
     dte_str = header['dte'].split(",")[0][:6]
@@ -56,7 +69,7 @@ def parse_igc(igc_file):
     dte_timestamp = dte.replace(tzinfo=timezone.utc).timestamp()
 
     # I record
-    irec = [x for x in lines if x[0] == "I"][0]
+    irec = recs["I"][0]
 
     # Get number of additions
     m = re.match(I_REC_RE, irec)
@@ -66,18 +79,13 @@ def parse_igc(igc_file):
     irec_re = "I\d{2}" + "(\d{4,6})([A-Z]{3})" * n_add
     m = re.match(irec_re, irec)
 
-    # Base RE and in/out dtypes
-    brec_re = B_REC_RE
-    in_types = [('hour', 'i8'), ('min', 'i8'), ('sec', 'i8'),
-                ('lat_deg', 'i8'), ('lat_min', 'i8'), ('ns', "S1"),
-                ('lon_deg', 'i8'), ('lon_min', 'i8'), ('ew', "S1"),
-                ('alt', 'i8'), ('alt_gps', 'i8')]
     out_types = [('utc', 'i8'),
                  ('lat', 'f8'), ('lon', 'f8'),
                  ('alt', 'i8'), ('alt_gps', 'i8')]
 
     # Additions
     add_types = []
+    add_lens = []
     for n in range(n_add):
         add_id = m.group(n * 2 + 2).lower()
 
@@ -91,43 +99,73 @@ def parse_igc(igc_file):
 
         add_type = IGC_TLA.get(add_id, "a%d" % add_len)
 
-        brec_re += "([A-Z0-9\-]{%d})" % add_len
         add_types.append((add_id, add_type))
-
-    # B records
-    brec = [x for x in lines if x[0] == "B"]
-    igc = np.fromregex(StringIO("\n".join(brec)), brec_re, in_types + add_types)
-
-    data = np.zeros(igc.shape[0], dtype=out_types + add_types)
+        add_lens.append(add_len)
+
+    # B records are fixed width - parse with vectorised byte arithmetic
+    # rather than a per-line regex
+    rec_len = 35 + sum(add_lens)
+    brec = [x[:rec_len] for x in recs["B"] if len(x) >= rec_len]
+    raw = np.frombuffer("".join(brec).encode('ascii', 'replace'),
+                        dtype=np.uint8).reshape(-1, rec_len)
+
+    # Discard malformed records (bad digits, hemispheres or fix validity)
+    digits = (raw >= ord('0')) & (raw <= ord('9'))
+    valid = (digits[:, 1:14].all(axis=1) &
+             digits[:, 15:23].all(axis=1) &
+             digits[:, 25:35].all(axis=1))
+    valid &= (raw[:, 14] == ord('N')) | (raw[:, 14] == ord('S'))
+    valid &= (raw[:, 23] == ord('E')) | (raw[:, 23] == ord('W'))
+    valid &= raw[:, 24] == ord('A')
+
+    offset = 35
+    for (add_id, add_type), add_len in zip(add_types, add_lens):
+        if add_type == 'i8':
+            valid &= digits[:, offset:offset + add_len].all(axis=1)
+        offset += add_len
+    raw = raw[valid]
+
+    data = np.zeros(raw.shape[0], dtype=out_types + add_types)
 
     # UTC times
-    secs = igc['hour'] * 3600 + igc['min'] * 60 + igc['sec']
+    secs = (parse_digits(raw, 1, 3) * 3600 + parse_digits(raw, 3, 5) * 60 +
+            parse_digits(raw, 5, 7))
     data['utc'] = dte_timestamp + np.unwrap(secs, period=3600*24)
 
     # Latitude/longitude
-    lat = igc['lat_deg'] + igc['lat_min'] / 60000
-    lon = igc['lon_deg'] + igc['lon_min'] / 60000
-
-    ones = np.ones(len(lon))
-    data['lat'] = lat * np.where(igc['ns'] == b"N", ones, -ones)
-    data['lon'] = lon * np.where(igc['ew'] == b"E", ones, -ones)
+    lat = parse_digits(raw, 7, 9) + parse_digits(raw, 9, 14) / 60000
+    lon = parse_digits(raw, 15, 18) + parse_digits(raw, 18, 23) / 60000
 
-    data['alt'] = igc['alt']
-    data['alt_gps'] = igc['alt_gps']
+    # Hemisphere signs, +/-1 from the comparison directly
+    data['lat'] = lat * (1 - 2 * (raw[:, 14] == ord('S')))
+    data['lon'] = lon * (1 - 2 * (raw[:, 23] == ord('W')))
 
-    for id, dtype in add_types:
-        data[id] = igc[id]
+    data['alt'] = parse_digits(raw, 25, 30)
+    data['alt_gps'] = parse_digits(raw, 30, 35)
 
-    # Bug in some loggers - remove duplicate time samples
-    u, idx = np.unique(data['utc'], return_index=True)
-    data = data[idx]
+    offset = 35
+    for (add_id, add_type), add_len in zip(add_types, add_lens):
+        if add_type == 'i8':
+            data[add_id] = parse_digits(raw, offset, offset + add_len)
+        else:
+            data[add_id] = (raw[:, offset:offset + add_len].copy()
+                            .view('S%d' % add_len)[:, 0])
+        offset += add_len
+
+    # Bug in some loggers - remove duplicate time samples. Times are
+    # already sorted so a diff mask avoids np.unique's sort
+    utc = data['utc']
+    mask = np.empty(len(utc), dtype=bool)
+    mask[:1] = True
+    np.not_equal(utc[1:], utc[:-1], out=mask[1:])
+    data = data[mask]
 
     # SeeYou data
-    rec = [x for x in lines if x.startswith("LCU::HPCIDCOMPETITIONID")]
+    rec = [x for x in recs["L"] if x.startswith("LCU::HPCIDCOMPETITIONID")]
     if (rec):
         header['cucid'] = rec[0].split(":")[-1].strip()
 
-    rec = [x for x in lines if x.startswith("LCU::HPPLTPILOT")]
+    rec = [x for x in recs["L"] if x.startswith("LCU::HPPLTPILOT")]
     if (rec):
         header['cuplt'] = rec[0].split(":")[-1].strip()
 
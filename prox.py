@@ -16,10 +16,12 @@
 # along with IGCVis.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import functools
 import itertools
 import logging
 import os.path
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 import numpy as np
@@ -29,47 +31,96 @@ from igcparser import parse_igc
 
 TDELTA = 1
 
-# Return new data filtered by minimum speed
-def speed_filter(data, min_speed):
-    t, x, y, z = np.transpose(data)
+# Read an IGC file and convert it to time/position arrays
+def load_log(igc_path, elevation, geoid):
+    print("Reading %s" % os.path.splitext(os.path.basename(igc_path))[0])
+    with open(igc_path, errors=None) as igc_file:
+        hdr, data = parse_igc(igc_file)
+    id = hdr.get('cucid') or hdr.get('cid') or hdr.get('gid') or hdr['id']
+
+    # Discard first few samples
+    data = data[5:]
+
+    # Materialise contiguous per-field arrays from the structured data
+    utc, lat, lon, alt_pressure, alt_gps = [
+            np.ascontiguousarray(data[f])
+            for f in ('utc', 'lat', 'lon', 'alt', 'alt_gps')]
+
+    tdelta_igc = igc.get_tdelta(utc)
+    if tdelta_igc > 4:
+        logging.warning("skipping, sample interval > 4 s, %d s" % tdelta_igc)
+        return None
+
+    # Convert to geoid referenced GPS
+    alt_geoid = igc.check_geoid(alt_gps, elevation, geoid)
+
+    # Convert to calibrated pressure altitude
+    alt = igc.calibrate_altitude(alt_pressure, alt_geoid)
+
+    # Convert and interpolate to local X/Y/Z
+    t, xyz = igc.resample_xyz(utc, lat, lon, alt, TDELTA)
+
+    # Store times and positions separately - positions as contiguous
+    # (N, 3) rows, matching how the pairwise distances consume them
+    return {'id': id, 't': t,
+            'xyz': np.stack((xyz[0], xyz[1], xyz[2]), axis=1)}
 
-    xyz = np.stack((x, y, z))
-    v = igc.speed(xyz, TDELTA)
+# Find indices of the common samples in two sorted time arrays
+def common_times(t1, t2):
+    if len(t2) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    # Both arrays are sorted and unique, so search one in the other
+    # rather than pay for intersect1d's concatenate-and-sort
+    idx = np.searchsorted(t2, t1)
+    idx[idx == len(t2)] = 0
+    mask = t2[idx] == t1
+
+    return np.nonzero(mask)[0], idx[mask]
+
+# Return time/position samples filtered by minimum speed
+def speed_filter(t, xyz, min_speed):
+    v = igc.speed(xyz.transpose(), TDELTA)
 
     v_xy = np.sqrt(v[0] ** 2 + v[1] ** 2)
 
-    return data[v_xy > min_speed]
+    mask = v_xy > min_speed
+    return t[mask], xyz[mask]
 
 def find_near_misses(logs, threshold, id):
-    for log1, log2 in itertools.permutations(logs, 2):
-        if id and id != log1['id']:
+    # Filter speed less than approx 20kts, once per log rather than
+    # once per pair
+    flogs = [{'id': log['id'],
+              'data': speed_filter(log['t'], log['xyz'], 10)}
+             for log in logs]
+
+    # Distance is symmetric, so each pair only needs checking once
+    for log1, log2 in itertools.combinations(flogs, 2):
+        if id and id not in (log1['id'], log2['id']):
             # Only find near misses for specified glider
             continue
 
-        # Filter speed less than approx 20kts
-        data1 = speed_filter(log1['data'], 10)
-        data2 = speed_filter(log2['data'], 10)
+        t1, xyz1 = log1['data']
+        t2, xyz2 = log2['data']
+
+        # Skip the pair if the flight windows don't overlap at all
+        if len(t1) == 0 or len(t2) == 0 or t1[-1] < t2[0] or t2[-1] < t1[0]:
+            continue
 
         # Find common time samples
-        t1, x1, y1, z1 = np.transpose(data1)
-        t2, x2, y2, z2 = np.transpose(data2)
-        i, c1, c2 = np.intersect1d(t1, t2, return_indices=True)
+        c1, c2 = common_times(t1, t2)
 
         # Bail out if no common samples
         if c1.size == 0:
             continue
 
-        # Select common times from the two logs
-        data1c = data1[c1]
-        data2c = data2[c2]
-
-        # Calculate distance between logs
-        xyz1 = np.array([(x[1], x[2], x[3]) for x in data1c])
-        xyz2 = np.array([(x[1], x[2], x[3]) for x in data2c])
-        dist = np.linalg.norm(xyz1 - xyz2, axis=1)
+        # Calculate squared distance between logs
+        delta = xyz1[c1] - xyz2[c2]
+        dist2 = np.einsum('ij,ij->i', delta, delta)
 
         # Find near miss indices
-        idx = np.where(dist < threshold)[0]
+        idx = np.where(dist2 < threshold ** 2)[0]
         if len(idx) > 0:
             print('%s -> %s' % (log1['id'], log2['id']))
 
@@ -77,36 +128,47 @@ def find_near_misses(logs, threshold, id):
             hits = np.split(idx, np.where(np.diff(idx) != 1)[0] + 1)
             for hit in hits:
                 # Find closest approach
-                hit_min_idx = np.argmin(dist[hit])
+                hit_min_idx = np.argmin(dist2[hit])
                 min_idx = hit[hit_min_idx]
 
                 utc = datetime.fromtimestamp(t1[c1[min_idx]], tz=tz)
                 utc_str = utc.strftime("%H:%M:%S")
-                print("  %s %.1fm" % (utc_str, dist[min_idx]))
+                print("  %s %.1fm" % (utc_str, np.sqrt(dist2[min_idx])))
 
 def find_gaggles(logs, threshold, tz):
+    # Filter speed less than approx 20kts, once per log rather than
+    # once per pair
+    flogs = [speed_filter(log['t'], log['xyz'], 10) for log in logs]
+
     gaggle_t = []
-    for log1, log2 in itertools.combinations(logs, 2):
-        # Filter speed less than approx 20kts
-        data1 = speed_filter(log1['data'], 10)
-        data2 = speed_filter(log2['data'], 10)
+    for (t1, xyz1), (t2, xyz2) in itertools.combinations(flogs, 2):
+        # Skip the pair if the flight windows don't overlap at all
+        if len(t1) == 0 or len(t2) == 0 or t1[-1] < t2[0] or t2[-1] < t1[0]:
+            continue
 
         # Find common time samples
-        t1, x1, y1, z1 = np.transpose(data1)
-        t2, x2, y2, z2 = np.transpose(data2)
-        i, c1, c2 = np.intersect1d(t1, t2, return_indices=True)
-
-        # Select common times from the two logs
-        data1c = data1[c1]
-        data2c = data2[c2]
-
-        # Calculate distance between logs
-        xyz1 = np.array([(x[1], x[2], x[3]) for x in data1c])
-        xyz2 = np.array([(x[1], x[2], x[3]) for x in data2c])
-        dist = np.linalg.norm(xyz1 - xyz2, axis=1)
-
-        idx = np.where(dist < threshold)
-        gaggle_t += [datetime.fromtimestamp(x, tz=tz).replace(tzinfo=None) for x in t1[c1[idx]]]
+        c1, c2 = common_times(t1, t2)
+
+        # Calculate squared distance between logs - no need for the
+        # sqrt just to compare against the threshold
+        delta = xyz1[c1] - xyz2[c2]
+        dist2 = np.einsum('ij,ij->i', delta, delta)
+
+        idx = np.where(dist2 < threshold ** 2)
+        gaggle_t.append(t1[c1[idx]])
+
+    # Convert to naive local datetimes in one bulk pass rather than a
+    # Python datetime per sample inside the pair loop
+    gaggle_t = np.concatenate(gaggle_t) if gaggle_t else np.empty(0)
+    if len(gaggle_t) > 0:
+        if tz is None:
+            offset = datetime.fromtimestamp(gaggle_t[0]).astimezone().utcoffset()
+        else:
+            offset = tz.utcoffset(None)
+        gaggle_t = ((gaggle_t + offset.total_seconds())
+                    .astype('datetime64[s]').tolist())
+    else:
+        gaggle_t = []
 
     from matplotlib import pyplot
     from matplotlib.dates import DateFormatter
@@ -122,9 +184,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('elevation', type=float, help='Takeoff elevation')
     parser.add_argument('dist', type=float, help='Near miss distance (m)')
-    parser.add_argument('igc', nargs='+',
-                        type=argparse.FileType('r', errors=None),
-                        help='IGC log file')
+    parser.add_argument('igc', nargs='+', help='IGC log file')
     parser.add_argument('-g', '--geoid', type=float, default=48.0,
                         help='Geoid height (m), default 48m')
     parser.add_argument('--gaggle', action='store_true',
@@ -139,34 +199,12 @@ if __name__ == '__main__':
     else:
         tz = timezone(timedelta(hours=args.utcoffset))
 
-    logs = []
-    for igc_file in args.igc:
-        print("Reading %s" % os.path.splitext(os.path.basename(igc_file.name))[0])
-        hdr, data = parse_igc(igc_file)
-        id = hdr.get('cucid') or hdr.get('cid') or hdr.get('gid') or hdr['id']
-
-        # Discard first few samples
-        data = data[5:]
-
-        utc, lat, lon = data['utc'], data['lat'], data['lon']
-        alt_pressure, alt_gps = data['alt'], data['alt_gps']
-
-        tdelta_igc = igc.get_tdelta(utc)
-        if tdelta_igc > 4:
-            logging.warning("skipping, sample interval > 4 s, %d s" % tdelta_igc)
-            continue
-
-        # Convert to geoid referenced GPS
-        alt_geoid = igc.check_geoid(alt_gps, args.elevation, args.geoid)
-
-        # Convert to calibrated pressure altitude
-        alt = igc.calibrate_altitude(alt_pressure, alt_geoid)
-
-        # Convert and interpolate to local X/Y/Z
-        t, xyz = igc.resample_xyz(utc, lat, lon, alt, TDELTA)
-
-        data = np.transpose(np.vstack((t, xyz[0], xyz[1], xyz[2])))
-        logs.append({'id': id, 'data': data})
+    # Preprocess logs in parallel, one process per file
+    worker = functools.partial(load_log, elevation=args.elevation,
+            geoid=args.geoid)
+    with ProcessPoolExecutor() as executor:
+        logs = [log for log in executor.map(worker, args.igc)
+                if log is not None]
 
     print("Searching for near misses...")
     find_near_misses(logs, args.dist, args.id)
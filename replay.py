@@ -16,18 +16,29 @@
 # along with IGCVis.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import os.path
 import socket
+import struct
 import sys
 import time
-import xdrlib
 
 import numpy as np
 
+# FGFS message body - 5 doubles (time, lag, position) then 15 floats
+# (orientation, velocity, angular velocity, accelerations). XDR is
+# big-endian IEEE, so a single struct replaces the deprecated xdrlib
+MSG_STRUCT = struct.Struct(">5d15f")
+
 class Replay:
     def __init__(self, logs, tdelta, aircraft, port):
         self.logs = logs
         self.tdelta = tdelta
-        self.port = port
+
+        # One UDP socket for the whole replay session. Deliberately not
+        # connected - a connected socket surfaces ICMP port-unreachable
+        # as ConnectionRefusedError when FG isn't listening yet
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addr = ("127.0.0.1", port)
 
         if aircraft == 'asg29':
             self.model = 'Aircraft/ASG29/Models/asg29.xml'
@@ -42,6 +53,23 @@ class Replay:
 
         self.log_len = len(logs[0]['data'])
 
+        # Model name padded to 96 bytes, fixed for the session
+        model = bytes(self.model, 'utf-8')
+        self.model_pad = model + bytes(96 - len(model))
+
+        # Message headers depend only on the log id, and the length
+        # field is constant because the XDR body layout is static
+        msg_len = 32 + len(self.model_pad) + MSG_STRUCT.size + 4
+        self.headers = {}
+        for log in logs:
+            idb = bytes(log['id'][:8], 'ascii')
+            self.headers[log['id']] = b"FGFS" + \
+                    bytes([0, 1, 0, 1,
+                           0, 0, 0, 7,
+                           0, 0, 0, msg_len,
+                           0, 0, 0, 0,
+                           0, 0, 0, 0]) + idb + bytes(8 - len(idb))
+
     def replay(self, n, freeze=False):
         for log in self.logs:
             x, y, z, orix, oriy, oriz, vx, vy, vz = log['data'][n]
@@ -51,70 +79,34 @@ class Replay:
             self.send_msg(log['id'], x, y, z, orix, oriy, oriz, vx, vy, vz)
 
     def send_msg(self, id, x, y, z, orix, oriy, oriz, vx, vy, vz):
-        model = bytes(self.model, 'utf-8')
-        model += bytearray(96 - len(model))
-
         # Not really sure what value this should be, but this seems to work
         lag = self.tdelta
 
-        # Pack XDR data
-        packer = xdrlib.Packer()
-
+        # Pack XDR data in one call - zeros are the angular velocity
+        # and the linear/angular accelerations
         utc_secs = time.time() % (24 * 3600)
-        packer.pack_double(utc_secs)
-        packer.pack_double(lag)
-
-        packer.pack_double(x)
-        packer.pack_double(y)
-        packer.pack_double(z)
-
-        packer.pack_float(orix)
-        packer.pack_float(oriy)
-        packer.pack_float(oriz)
-
-        packer.pack_float(vx)
-        packer.pack_float(vy)
-        packer.pack_float(vz)
-
-        # Angular velocity
-        packer.pack_float(0)
-        packer.pack_float(0)
-        packer.pack_float(0)
-
-        # Linear acceleration
-        packer.pack_float(0)
-        packer.pack_float(0)
-        packer.pack_float(0)
-
-        # Angular acceleration
-        packer.pack_float(0)
-        packer.pack_float(0)
-        packer.pack_float(0)
-
-        data = model + packer.get_buffer() + bytearray(4)
-
-        # Make header
-        idb = bytes(id[:8], 'ascii')
-        hdr = b"FGFS" + \
-              bytearray([0, 1, 0, 1,
-                         0, 0, 0, 7,
-                         0, 0, 0, len(data)+32,
-                         0, 0, 0, 0,
-                         0, 0, 0, 0]) + idb + bytearray(8 - len(idb))
-        msg = hdr + data
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(msg, ("127.0.0.1", self.port))
+        body = MSG_STRUCT.pack(utc_secs, lag, x, y, z,
+                               orix, oriy, oriz, vx, vy, vz,
+                               0, 0, 0, 0, 0, 0, 0, 0, 0)
+
+        msg = self.headers[id] + self.model_pad + body + bytes(4)
+
+        self.sock.sendto(msg, self.addr)
 
 #----------------------------------------------------------------------
 
-# Calculate minimum distance between two logs
-def min_distance(data1, data2):
-    xyz1 = np.array([(x[0], x[1], x[2]) for x in data1])
-    xyz2 = np.array([(x[0], x[1], x[2]) for x in data2])
+# Load replay data, with optional binary sidecar for the log arrays
+def load_data(fp):
+    data = json.load(fp)
+
+    if 'bin' in data:
+        bin_path = os.path.join(os.path.dirname(fp.name), data['bin'])
+        arr = np.load(bin_path)
+
+        for i, log in enumerate(data['logs']):
+            log['data'] = arr[i]
 
-    dist = np.linalg.norm(xyz1 - xyz2, axis=1)
-    return np.min(dist)
+    return data
 
 # Replay log data
 def find_logs(id, logs, dist):
@@ -130,15 +122,22 @@ def find_logs(id, logs, dist):
         sys.exit()
 
     replay_logs = [ref_log]
+    others = [log for log in logs if log['id'] != id]
 
-    # Find close encounters
+    # Find close encounters - minimum distances for all logs in one
+    # broadcast against the reference track
     print("Minimum distances:")
-    for log in logs:
-        log_id = log['id']
-        if log_id != id:
-            mdist = min_distance(ref_log['data'], log['data'])
+    if others:
+        ref_xyz = np.asarray(ref_log['data'])[:, :3]
+        delta = np.stack([np.asarray(log['data'])[:, :3] for log in others])
+        delta -= ref_xyz
+        dist2 = np.einsum('ntk,ntk->nt', delta, delta)
+        min_dists = np.sqrt(dist2.min(axis=1))
+
+        for log, mdist in zip(others, min_dists):
             if mdist <= dist:
-                print("  Adding log " + log_id + ", minimum distance %d m" % mdist)
+                print("  Adding log " + log['id'] +
+                      ", minimum distance %d m" % mdist)
                 replay_logs.append(log)
 
     return replay_logs
@@ -160,7 +159,7 @@ if __name__ == '__main__':
             default='asg29', help='aircraft model')
     args = parser.parse_args()
 
-    data = json.load(args.file)
+    data = load_data(args.file)
     if args.list:
         print(", ".join(data['ids']))
         sys.exit(0)
@@ -170,6 +169,13 @@ if __name__ == '__main__':
     replay_logs = find_logs(args.id, data['logs'], args.dist)
 
     replay = Replay(replay_logs, tdelta, args.aircraft, args.port)
+
+    # Pace frames from a monotonic deadline so the send time doesn't
+    # accumulate as replay drift
+    start = time.monotonic()
     for i in range(replay.log_len):
         replay.replay(i)
-        time.sleep(tdelta)
+
+        delay = start + (i + 1) * tdelta - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -20,43 +20,57 @@ import html
 import os.path
 import re
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 import requests
 
+DOWNLOAD_RE = re.compile("Download IGC")
+
+# Download an IGC log, streaming straight to file
+def download_log(session, log_url, log_path):
+    with session.get(log_url, stream=True) as log_req:
+        # SeeYou doesn't set encoding in the response header, so write
+        # the bytes as received rather than round-trip through text
+        with open(log_path, "wb") as f:
+            for chunk in log_req.iter_content(65536):
+                f.write(chunk)
+
 def get_logs(url, log_dir):
-    req = requests.get(url)
+    # Session keeps the TCP/TLS connection alive between requests
+    session = requests.Session()
+    req = session.get(url)
 
     # Find the download pop-ups
     soup = BeautifulSoup(req.text, "html.parser")
     links = soup.find_all('a', attrs={'data-toggle': 'popover'})
 
-    for link in links:
-        cn = link.string.strip()
-        print("Downloading " + cn)
+    downloads = []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for link in links:
+            cn = link.string.strip()
+            print("Downloading " + cn)
 
-        # Extract the download link
-        dl_soup = BeautifulSoup(html.unescape(link['data-content']),
-                "html.parser")
-        href = dl_soup.find(string=re.compile("Download IGC")).parent['href']
+            # Extract the download link
+            dl_soup = BeautifulSoup(html.unescape(link['data-content']),
+                    "html.parser")
+            href = dl_soup.find(string=DOWNLOAD_RE).parent['href']
 
-        # Get the log file URL
-        split_url = urllib.parse.urlsplit(href)
-        if split_url.netloc == "":
-            split_url = split_url._replace(scheme="https",
-                                           netloc="www.soaringspot.com")
-        log_url = urllib.parse.urlunsplit(split_url)
+            # Get the log file URL
+            split_url = urllib.parse.urlsplit(href)
+            if split_url.netloc == "":
+                split_url = split_url._replace(scheme="https",
+                                               netloc="www.soaringspot.com")
+            log_url = urllib.parse.urlunsplit(split_url)
 
-        # Download log file
-        log_req = requests.get(log_url)
-        # SeeYou doesn't set encoding in response header. May need to set it
-        # manually if requests guesses wrong
-        # log_req.encoding = "windows-1252"
+            # Download log file
+            log_path = os.path.join(log_dir, cn + ".igc")
+            downloads.append(
+                    executor.submit(download_log, session, log_url, log_path))
 
-        # Write to file
-        log_path = os.path.join(log_dir, cn + ".igc")
-        with open(log_path, "wt") as f:
-            f.write(log_req.text)
+    # Surface any download errors
+    for download in downloads:
+        download.result()
 
 if __name__ == '__main__':
     import argparse